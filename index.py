@@ -1,56 +1,200 @@
 import streamlit as st
-import streamlit.components.v1 as components
-import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from PIL import Image
-import piexif
 import logging
-import traceback
-import io
+import logging.handlers
 import os
+import io
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from streamlit_js_eval import get_geolocation, streamlit_js_eval
+import hashlib
+import struct
+import itertools
+import random
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Configure logging (INFO by default; set LOG_LEVEL=DEBUG for tracing)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_log_handlers = [logging.StreamHandler()]
+
+# Writing to road_distress_app.log is opt-in (LOG_TO_FILE=1). File records
+# are buffered in memory and written in one burst on ERROR or once 100
+# records have accumulated, instead of one write per record. The file is
+# rotated at 1 MB with two backups so it can't fill a small disk.
+if os.environ.get("LOG_TO_FILE"):
+    _log_file_handler = logging.handlers.RotatingFileHandler(
+        "road_distress_app.log",
+        maxBytes=1_000_000,
+        backupCount=2,
+        delay=True
+    )
+    _log_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _log_handlers.append(logging.handlers.MemoryHandler(
+        capacity=100,
+        flushLevel=logging.ERROR,
+        target=_log_file_handler
+    ))
 
-# Configure logging
 logging.basicConfig(
-    level=logging.DEBUG, 
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("road_distress_app.log"),
-        logging.StreamHandler()
-    ]
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(), 
+    format=LOG_FORMAT,
+    handlers=_log_handlers
 )
 logger = logging.getLogger(__name__)
 
+# Rate-limit and transient server errors worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Pooled HTTP session for ImgBB and Pantry, retrying rate limits and
+# transient server errors with exponential backoff. Streamlit re-executes
+# this script on every rerun, so the session is kept as a cached resource.
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    retry = Retry(
+        total=5,
+        backoff_factor=0.8,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "POST", "PUT"])
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry))
+    
+    # ImgBB rate limits are per key, so a 429 is handed back to
+    # upload_to_imgbb to try the next key instead of retrying this one.
+    # Read timeouts aren't retried: ImgBB may already have stored the image,
+    # and each retry would upload it again.
+    imgbb_retry = Retry(
+        total=5,
+        read=0,
+        backoff_factor=0.8,
+        status_forcelist=tuple(status for status in RETRY_STATUSES if status != 429),
+        allowed_methods=frozenset(["POST"])
+    )
+    session.mount("https://api.imgbb.com/", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=imgbb_retry))
+    return session
+
+_HTTP = get_http_session()
+
+# ImgBB API keys come from the environment (IMGBB_KEYS=k1,k2,... or a single
+# IMGBB_KEY) or from IMGBB_KEYS in Streamlit secrets, as a list or a
+# comma-separated string. The cycle is a cached resource, so every session
+# shares it and concurrent uploads are spread across the keys' rate limits.
+@st.cache_resource(show_spinner=False)
+def get_imgbb_keys():
+    keys = os.environ.get("IMGBB_KEYS") or os.environ.get("IMGBB_KEY")
+    if not keys:
+        try:
+            keys = st.secrets.get("IMGBB_KEYS") or st.secrets.get("IMGBB_KEY")
+        except Exception as e:
+            logger.debug("No ImgBB keys in Streamlit secrets: %s", e)
+    
+    if isinstance(keys, str):
+        keys = keys.split(",")
+    keys = tuple(key.strip() for key in keys or () if key.strip())
+    if not keys:
+        logger.error("No ImgBB API key configured (set IMGBB_KEY or IMGBB_KEYS)")
+        return (), None
+    
+    return keys, itertools.cycle(keys)
+
+_IMGBB_KEYS, _IMGBB_KEY_CYCLE = get_imgbb_keys()
+
+# Only JPEG and PNG files under 32 MB are sent to ImgBB
+JPEG_MAGIC = b'\xff\xd8\xff'
+PNG_MAGIC = b'\x89PNG'
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+
+# The uploaded copy is only viewed from the sheet, so anything larger than
+# this is scaled down and re-encoded before it goes over the network
+# (set UPLOAD_MAX_EDGE to keep more detail, e.g. 1920)
+UPLOAD_MAX_EDGE = int(os.environ.get("UPLOAD_MAX_EDGE", 1600))
+UPLOAD_JPEG_QUALITY = 85
+
+def downscale_image(image_bytes):
+    """
+    Shrink an image to fit within UPLOAD_MAX_EDGE and re-encode it as JPEG
+    
+    :param image_bytes: Raw bytes of a JPEG or PNG image
+    :return: JPEG bytes with the original EXIF, or the input if already small
+    """
+    # Pillow is only needed in the upload worker, so import it here
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if max(img.size) <= UPLOAD_MAX_EDGE:
+            return image_bytes
+        
+        exif = img.info.get("exif", b"")
+        img.thumbnail((UPLOAD_MAX_EDGE, UPLOAD_MAX_EDGE), Image.Resampling.LANCZOS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True, exif=exif)
+        return buffer.getvalue()
+
+# Full rotations through the ImgBB keys before giving up on rate limits;
+# the backoff between them stays well inside IMGBB_RESULT_TIMEOUT
+IMGBB_RATE_LIMIT_ROUNDS = 3
+
 # ImgBB Image Upload Function
-def upload_to_imgbb(image_file):
+def upload_to_imgbb(image_bytes, filename="image.jpg"):
     """
     Upload an image to ImgBB and return the direct view URL
     
-    :param image_file: File-like object of the image to upload
+    :param image_bytes: Raw bytes of the image to upload
+    :param filename: File name sent with the multipart upload
     :return: Direct view URL or None if upload fails
     """
     try:
-        # Read the image file
-        image_bytes = image_file.getvalue()
+        # Reject oversized or non-image files before any network call
+        if len(image_bytes) >= MAX_UPLOAD_BYTES:
+            logger.error("Image too large for ImgBB upload: %s bytes", len(image_bytes))
+            return None
+        if not image_bytes.startswith((JPEG_MAGIC, PNG_MAGIC)):
+            logger.error("Unsupported image format for ImgBB upload: %r", image_bytes[:12])
+            return None
         
-        # Encode the image to base64
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        if not _IMGBB_KEYS:
+            logger.error("Skipping ImgBB upload, no API key configured")
+            return None
+        
+        # Upload a scaled-down copy; GPS is read from the original bytes
+        try:
+            image_bytes = downscale_image(image_bytes)
+        except Exception as e:
+            logger.warning("Could not downscale image, uploading original: %s", e)
         
         # ImgBB API endpoint
         url = "https://api.imgbb.com/1/upload"
         
-        # Parameters for the API request
-        payload = {
-            'key': '64869f569c72df2121fa2640ae4b3d1f',  # API key
-            'image': base64_image
+        # Send the raw bytes as a multipart file instead of a base64 field
+        mime_type = 'image/jpeg' if image_bytes.startswith(JPEG_MAGIC) else 'image/png'
+        files = {
+            'image': (filename, image_bytes, mime_type)
         }
         
-        # Send POST request to ImgBB
-        response = requests.post(url, data=payload)
+        # Send POST request to ImgBB, moving on to the next key whenever
+        # the current one is rate limited. Once every key has returned 429,
+        # back off before another round; with a single key this is a plain
+        # backoff-and-retry.
+        for attempt in range(IMGBB_RATE_LIMIT_ROUNDS):
+            if attempt:
+                delay = min(30, 2 * 2 ** (attempt - 1)) + random.uniform(0, 0.5)
+                logger.warning("All ImgBB keys rate limited, retrying in %.1fs", delay)
+                time.sleep(delay)
+            
+            for _ in range(len(_IMGBB_KEYS)):
+                payload = {
+                    'key': next(_IMGBB_KEY_CYCLE)
+                }
+                response = _HTTP.post(url, data=payload, files=files, timeout=(3, 60))
+                if response.status_code != 429:
+                    break
+                logger.warning("ImgBB key rate limited, trying the next key")
+            
+            if response.status_code != 429:
+                break
         
         # Check if the upload was successful
         if response.status_code == 200:
@@ -62,21 +206,51 @@ def upload_to_imgbb(image_file):
                 return result['data']['display_url']
         
         # Log any errors
-        logger.error(f"ImgBB upload failed. Status code: {response.status_code}")
-        logger.error(f"Response: {response.text}")
+        logger.error("ImgBB upload failed. Status code: %s", response.status_code)
+        logger.error("Response: %s", response.text)
         return None
     
     except Exception as e:
-        logger.error(f"Error uploading to ImgBB: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error uploading to ImgBB: %s", e)
         return None
 
+# Longest a submit waits for a background upload before going without a URL
+IMGBB_RESULT_TIMEOUT = 90
+
+# Background pool for ImgBB uploads, cached so uploads started on one rerun
+# can still be collected on a later one
+@st.cache_resource(show_spinner=False)
+def get_upload_executor():
+    return ThreadPoolExecutor(max_workers=4)
+
+def start_image_upload(image_bytes, filename, digest):
+    """
+    Start an ImgBB upload in the background, once per distinct image unless
+    the previous attempt finished without a URL
+    
+    :param image_bytes: Raw bytes of the image to upload
+    :param filename: File name sent with the multipart upload
+    :param digest: Content hash of the image, used as the upload key
+    :return: Future resolving to the direct view URL or None
+    """
+    uploads = st.session_state.setdefault('image_uploads', {})
+    upload = uploads.get(digest)
+    
+    # upload_to_imgbb returns None instead of raising on timeouts, server
+    # errors or exhausted keys, so a finished upload without a URL is retried
+    if upload is None or (upload.done() and upload.result() is None):
+        uploads[digest] = get_upload_executor().submit(upload_to_imgbb, image_bytes, filename)
+    
+    return uploads[digest]
+
+# The Pantry basket is effectively static, so keep it for an hour
+@st.cache_data(ttl=3600, show_spinner=False)
 def fetch_credentials_from_pantry():
     pantry_url = "https://getpantry.cloud/apiv1/pantry/2b37110f-cba8-408c-afe9-2e150aa440c1/basket/newBasket55"
     
     try:
         # Fetch data from Pantry
-        response = requests.get(pantry_url)
+        response = _HTTP.get(pantry_url, timeout=(3, 30))
         response.raise_for_status()  # Raise an exception for HTTP errors
         
         # Parse JSON content
@@ -85,171 +259,422 @@ def fetch_credentials_from_pantry():
         return credentials_data
     except requests.exceptions.RequestException as e:
         st.error(f"Error fetching data from Pantry: {e}")
-        logger.error(f"Error fetching data from Pantry: {e}")
+        logger.error("Error fetching data from Pantry: %s", e)
+        return None
+
+# Load the service account from Streamlit secrets
+# ([gcp_service_account] in .streamlit/secrets.toml). Only called from the
+# cached authenticate_google_sheets, so it runs (and warns) once per process
+# rather than on every rerun.
+def load_credentials_from_secrets():
+    try:
+        return dict(st.secrets["gcp_service_account"])
+    except Exception as e:
+        logger.warning("No gcp_service_account in Streamlit secrets: %s", e)
         return None
 
-# Authenticate with Google Sheets using credentials from Pantry
+# Authenticate with Google Sheets using the service account from secrets.
+# The legacy Pantry basket is only consulted when USE_PANTRY_CREDENTIALS is
+# set. The authorized client is cached for the process so the PEM key is
+# parsed once and reruns reuse the OAuth token.
+@st.cache_resource(ttl=3000, show_spinner=False)
 def authenticate_google_sheets():
     try:
-        # Fetch credentials from Pantry
-        credentials_data = fetch_credentials_from_pantry()
+        credentials_data = load_credentials_from_secrets()
+        if not credentials_data and os.environ.get("USE_PANTRY_CREDENTIALS"):
+            credentials_data = fetch_credentials_from_pantry()
+            if not credentials_data:
+                # Don't keep a failed Pantry fetch cached for the full hour
+                fetch_credentials_from_pantry.clear()
         
         if not credentials_data:
-            st.error("Failed to fetch credentials from Pantry")
-            logger.error("Failed to fetch credentials from Pantry")
+            st.error("Failed to load Google service account credentials")
+            logger.error("Failed to load Google service account credentials")
             return None
 
         # Define the scope for Google Sheets and Drive
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+        scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+        # Imported lazily so the form renders before the Google client
+        # libraries are loaded
+        import gspread
+        from google.oauth2.service_account import Credentials
 
         try:
-            # Authenticate using the credentials from Pantry (google.oauth2 service_account Credentials)
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(credentials_data, scopes=scope)
+            # Authenticate using the service account credentials
+            creds = Credentials.from_service_account_info(credentials_data, scopes=scope)
             
             # Authorize with gspread
             client = gspread.authorize(creds)
-            
-            # Log accessible spreadsheets (just for debugging purposes)
-            spreadsheets = client.openall()
-            logger.info("Accessible Spreadsheets:")
-            for sheet in spreadsheets:
-                logger.info(f"- {sheet.title}")
+            logger.info("Authorized Google Sheets client")
             
             return client
         except Exception as auth_error:
             st.error(f"Authentication Error: {auth_error}")
-            logger.error(f"Authentication Error: {auth_error}")
-            logger.error(traceback.format_exc())
+            logger.exception("Authentication Error: %s", auth_error)
             return None
 
     except Exception as e:
         st.error(f"Unexpected error: {e}")
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return None
 
-def submit_to_google_sheets(client, data_to_submit):
+# Sheet header row; submitted rows are built in this column order
+SHEET_COLUMNS = (
+    "Road Name", "District", "Road Type", "City",
+    "Distress Type", "Severity", "Distress Length (m)",
+    "Distress Width (m)", "Latitude", "Longitude",
+    "Additional Notes", "Image URL"
+)
+
+# Spreadsheet ID of the target sheet, from the SHEET_KEY environment variable
+# or sheet_id in Streamlit secrets. When set, the sheet is opened directly by
+# key instead of searching Drive by title.
+def load_sheet_key():
+    if os.environ.get("SHEET_KEY"):
+        return os.environ["SHEET_KEY"]
+    
     try:
-        # List all accessible spreadsheets to verify
-        spreadsheets = client.openall()
-        logger.info(f"Accessible Spreadsheets: {[sheet.title for sheet in spreadsheets]}")
+        return st.secrets.get("sheet_id")
+    except Exception as e:
+        logger.debug("No sheet_id in Streamlit secrets: %s", e)
+        return None
+
+SHEET_KEY = load_sheet_key()
+
+def ensure_sheet(client, title="Road Distress Data"):
+    """
+    Find the survey spreadsheet by title, creating and seeding it if needed
+    
+    :param client: Authorized gspread client
+    :param title: Title of the spreadsheet to look for or create
+    :return: The gspread Spreadsheet holding the survey data
+    """
+    import gspread
+    
+    # Try to open the sheet with exact matching
+    try:
+        spreadsheet = client.open(title)
+    except gspread.SpreadsheetNotFound:
+        # If exact match fails, try partial match. The Drive file listing is
+        # a single metadata query; only the matching spreadsheet is opened,
+        # unlike openall() which fetches every spreadsheet it can see
+        spreadsheet_files = client.list_spreadsheet_files()
+        matching_files = [f for f in spreadsheet_files if "Road Distress" in f['name']]
         
-        # Try to open the sheet with exact matching
+        if matching_files:
+            logger.info("Found matching sheet: %s", matching_files[0]['name'])
+            spreadsheet = client.open_by_key(matching_files[0]['id'])
+        else:
+            # If no matching sheet found, create a new one with headers
+            spreadsheet = client.create(title)
+            spreadsheet.sheet1.update(range_name='A1:L1', values=[list(SHEET_COLUMNS)])
+            logger.info("Created new spreadsheet with headers")
+    
+    # Point the app at this ID so later processes skip the title search
+    logger.info("Using spreadsheet %s; set SHEET_KEY to open it directly", spreadsheet.id)
+    return spreadsheet
+
+# Open the target worksheet once and reuse the handle across submissions.
+# The handle is bound to the client that opened it, so it shares the
+# client's TTL and is cleared together with it (see reset_google_sheets).
+@st.cache_resource(ttl=3000, show_spinner=False)
+def get_worksheet(_client, title="Road Distress Data"):
+    # A configured key is authoritative: never fall back to searching or
+    # creating a sheet, which would silently split the data
+    if SHEET_KEY:
+        return _client.open_by_key(SHEET_KEY).sheet1
+    
+    return ensure_sheet(_client, title).sheet1
+
+# Drop the cached client and the worksheet opened with it, so the next
+# submit re-reads the secrets and authorizes again (e.g. after a key has
+# been revoked and replaced)
+def reset_google_sheets():
+    authenticate_google_sheets.clear()
+    get_worksheet.clear()
+
+# Rows are written as soon as this many have been submitted. The default of
+# 1 writes every submission immediately; a larger PENDING_ROWS_FLUSH_SIZE
+# opts into batching, where queued rows live only in this browser session
+# and are lost if the tab is closed before they are flushed. A queued batch
+# is also flushed by the next submit once its oldest row is this many
+# seconds old, or manually with the Flush button.
+PENDING_ROWS_FLUSH_SIZE = max(1, int(os.environ.get("PENDING_ROWS_FLUSH_SIZE", 1)))
+PENDING_ROWS_MAX_AGE = 300
+
+def submit_to_google_sheets(client, data_to_submit):
+    # Prepare row data in the same order as the sheet headers
+    row_data = [data_to_submit.get(column, '') for column in SHEET_COLUMNS]
+    
+    # Queue the row; only hit the API once the batch is full or stale
+    pending_rows = st.session_state.setdefault('pending_rows', [])
+    if not pending_rows:
+        st.session_state['pending_since'] = time.monotonic()
+    pending_rows.append(row_data)
+    logger.debug("Queued row for Google Sheets (%s pending)", len(pending_rows))
+    
+    pending_age = time.monotonic() - st.session_state['pending_since']
+    if len(pending_rows) < PENDING_ROWS_FLUSH_SIZE and pending_age < PENDING_ROWS_MAX_AGE:
+        return True
+    if flush_pending_rows(client):
+        return True
+    
+    # This row wasn't written; drop it so resubmitting the form (which keeps
+    # its values) doesn't queue it a second time
+    pending_rows.pop()
+    return False
+
+# Google Sheets calls go through gspread's own session, so rate limits from
+# it are retried here with jittered exponential backoff. Only 429 is retried
+# by default: a 429 means the request was rejected, while a 5xx may arrive
+# after the server already applied it, and retrying a non-idempotent call
+# such as an INSERT_ROWS append would then write the rows twice. Pass
+# retry_statuses=RETRY_STATUSES only for calls that are safe to repeat.
+SHEETS_RETRY_ATTEMPTS = 5
+
+def call_with_backoff(func, *args, retry_statuses=(429,), **kwargs):
+    import gspread
+    
+    for attempt in range(SHEETS_RETRY_ATTEMPTS):
         try:
-            sheet = client.open("Road Distress Data").sheet1
-        except gspread.SpreadsheetNotFound:
-            # If exact match fails, try partial match
-            matching_sheets = [s for s in spreadsheets if "Road Distress" in s.title]
+            return func(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = e.response.status_code
+            if status not in retry_statuses or attempt == SHEETS_RETRY_ATTEMPTS - 1:
+                raise
             
-            if matching_sheets:
-                sheet = matching_sheets[0].sheet1
-                logger.info(f"Found matching sheet: {matching_sheets[0].title}")
-            else:
-                # If no matching sheet found, create a new one
-                new_sheet = client.create("Road Distress Data")
-                sheet = new_sheet.sheet1
-                
-                # Add headers
-                headers = [
-                    "Road Name", "District", "Road Type", "City", 
-                    "Distress Type", "Severity", "Distress Length (m)", 
-                    "Distress Width (m)", "Latitude", "Longitude", 
-                    "Additional Notes", "Image URL"
-                ]
-                sheet.append_row(headers)
-                logger.info("Created new spreadsheet with headers")
-        
-        # Prepare row data in the correct order
-        row_data = [
-            data_to_submit.get('Road Name', ''),
-            data_to_submit.get('District', ''),
-            data_to_submit.get('Road Type', ''),
-            data_to_submit.get('City', ''),
-            data_to_submit.get('Distress Type', ''),
-            data_to_submit.get('Severity', ''),
-            data_to_submit.get('Distress Length (m)', ''),
-            data_to_submit.get('Distress Width (m)', ''),
-            data_to_submit.get('Latitude', ''),
-            data_to_submit.get('Longitude', ''),
-            data_to_submit.get('Additional Notes', ''),
-            data_to_submit.get('Image URL', '')
-        ]
-        
-        # Append row to sheet
-        sheet.append_row(row_data)
-        logger.info("Data successfully submitted to Google Sheets")
+            delay = min(30, 0.5 * 2 ** attempt) + random.uniform(0, 0.5)
+            logger.warning("Google Sheets returned %s, retrying in %.1fs", status, delay)
+            time.sleep(delay)
+
+def flush_pending_rows(client):
+    from gspread.utils import absolute_range_name
+    
+    pending_rows = st.session_state.get('pending_rows', [])
+    if not pending_rows:
+        return True
+    
+    try:
+        sheet = get_worksheet(client)
+        
+        # Append all queued rows with one values.append request against the
+        # cached spreadsheet ID; no Drive lookup or sheet metadata fetch
+        call_with_backoff(
+            sheet.spreadsheet.values_append,
+            # Quotes the title and escapes any apostrophes in it
+            absolute_range_name(sheet.title, "A1"),
+            params={
+                'valueInputOption': 'USER_ENTERED',
+                'insertDataOption': 'INSERT_ROWS'
+            },
+            body={'values': pending_rows}
+        )
+        logger.info("%s rows successfully submitted to Google Sheets", len(pending_rows))
+        st.session_state['pending_rows'] = []
         return True
     
     except Exception as e:
-        logger.error(f"Google Sheets submission error: {e}")
-        logger.error(f"Full traceback: {traceback.format_exc()}")
+        logger.exception("Google Sheets submission error: %s", e)
         st.error(f"Error submitting to Google Sheets: {e}")
+        # Don't keep failing with the same cached client; re-authorize next time
+        reset_google_sheets()
         return False
 
 # GPS Coordinate Extraction Functions
-def extract_gps_from_image(image):
+
+# EXIF (APP1) is at the start of a JPEG; only markers in this head are searched
+EXIF_HEAD_BYTES = 128 * 1024
+
+# Only JPEG (SOI) and TIFF (little/big endian) files are handed to piexif
+EXIF_MAGICS = (b'\xff\xd8', b'II*\x00', b'MM\x00*')
+
+# GPS IFD tags for the latitude/longitude references and DMS values
+GPS_TAG_NAMES = {
+    1: 'latitude_ref',
+    2: 'latitude',
+    3: 'longitude_ref',
+    4: 'longitude'
+}
+
+def extract_exif_bytes(image_bytes):
+    """
+    Return a JPEG's raw EXIF APP1 payload without decoding the image
+    
+    :param image_bytes: Raw bytes of a JPEG image
+    :return: APP1 payload (Exif header + TIFF data), or None if there is none
+    :raises ValueError: If the marker segments are malformed, or the Exif
+        segment isn't found among the markers in the first EXIF_HEAD_BYTES
+    """
+    if not image_bytes.startswith(b'\xff\xd8'):
+        raise ValueError("Not a JPEG image")
+    
+    # Walk the marker segments after SOI until the Exif APP1 segment; only
+    # that segment is sliced out, however far it runs past the head
+    pos = 2
+    while pos < EXIF_HEAD_BYTES:
+        if pos + 4 > len(image_bytes) or image_bytes[pos] != 0xFF:
+            raise ValueError("Malformed JPEG marker segments")
+        marker = image_bytes[pos + 1]
+        (segment_length,) = struct.unpack_from('>H', image_bytes, pos + 2)
+        if marker == 0xE1 and image_bytes[pos + 4:pos + 10] == b'Exif\x00\x00':
+            if pos + 2 + segment_length > len(image_bytes):
+                raise ValueError("Truncated EXIF segment")
+            return image_bytes[pos + 4:pos + 2 + segment_length]
+        if marker == 0xDA:
+            # Start of scan: no metadata segments follow
+            return None
+        pos += 2 + segment_length
+    
+    # Large APP0/APP2/XMP segments can push APP1 past the head; that isn't
+    # "no EXIF", so let the caller parse the whole file instead
+    raise ValueError("No EXIF segment within the file head")
+
+def get_gps_fast(image_bytes):
+    """
+    Read the GPS latitude/longitude tags straight from a JPEG's APP1 segment
+    
+    :param image_bytes: Raw bytes of a JPEG image
+    :return: GPS info dict, or None if the image has no GPS data
+    :raises ValueError: If the EXIF structure can't be parsed this way
+    """
+    exif_bytes = extract_exif_bytes(image_bytes)
+    if exif_bytes is None:
+        return None
+    tiff = exif_bytes[6:]
+    
+    # The TIFF header gives the byte order and the offset of IFD0
+    endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if endian is None:
+        raise ValueError("Invalid TIFF byte order")
+    (ifd0_offset,) = struct.unpack_from(endian + 'I', tiff, 4)
+    
+    # Find the GPSInfo (0x8825) pointer in IFD0
+    gps_offset = None
+    (entry_count,) = struct.unpack_from(endian + 'H', tiff, ifd0_offset)
+    for index in range(entry_count):
+        tag, _, _, value = struct.unpack_from(endian + 'HHII', tiff, ifd0_offset + 2 + 12 * index)
+        if tag == 0x8825:
+            gps_offset = value
+            break
+    if gps_offset is None:
+        return None
+    
+    # Read only tags 1-4 from the GPS IFD
+    gps_info = {}
+    (entry_count,) = struct.unpack_from(endian + 'H', tiff, gps_offset)
+    for index in range(entry_count):
+        entry = gps_offset + 2 + 12 * index
+        tag, value_type, count = struct.unpack_from(endian + 'HHI', tiff, entry)
+        if tag in (1, 3):
+            # One-letter ASCII reference ("N\0"), stored inline
+            gps_info[GPS_TAG_NAMES[tag]] = tiff[entry + 8:entry + 9]
+        elif tag in (2, 4):
+            # Three unsigned RATIONALs (degrees, minutes, seconds)
+            if value_type != 5 or count != 3:
+                raise ValueError("Unexpected GPS coordinate type %d" % value_type)
+            (value_offset,) = struct.unpack_from(endian + 'I', tiff, entry + 8)
+            values = struct.unpack_from(endian + '6I', tiff, value_offset)
+            gps_info[GPS_TAG_NAMES[tag]] = tuple(zip(values[::2], values[1::2]))
+    
+    if 'latitude' not in gps_info or 'longitude' not in gps_info:
+        return None
+    return gps_info
+
+def get_gps_with_piexif(image_bytes):
+    """
+    Read the GPS latitude/longitude tags with piexif
+    
+    :param image_bytes: Raw bytes of a JPEG or TIFF image
+    :return: GPS info dict, or None if the image has no GPS data
+    """
+    # Imported lazily so sessions that never upload a photo don't load it
+    import piexif
+    
+    # For JPEGs, hand piexif just the APP1 payload so it doesn't rescan the
+    # file; TIFFs and JPEGs with unusual marker layouts are passed whole
+    exif_bytes = image_bytes
+    if image_bytes.startswith(b'\xff\xd8'):
+        try:
+            exif_bytes = extract_exif_bytes(image_bytes)
+        except ValueError as e:
+            logger.debug("Could not locate APP1 segment (%s), parsing the whole file", e)
+            exif_bytes = image_bytes
+        if exif_bytes is None:
+            return None
+    
+    gps_ifd = piexif.load(exif_bytes)['GPS']
+    
+    if (piexif.GPSIFD.GPSLatitude not in gps_ifd or
+        piexif.GPSIFD.GPSLongitude not in gps_ifd):
+        return None
+    
+    return {
+        'latitude': gps_ifd.get(piexif.GPSIFD.GPSLatitude),
+        'latitude_ref': gps_ifd.get(piexif.GPSIFD.GPSLatitudeRef),
+        'longitude': gps_ifd.get(piexif.GPSIFD.GPSLongitude),
+        'longitude_ref': gps_ifd.get(piexif.GPSIFD.GPSLongitudeRef)
+    }
+
+def extract_gps_from_image(image_bytes):
     try:
-        logger.info("Starting GPS extraction from image")
+        logger.debug("Starting GPS extraction from image (%d bytes)", len(image_bytes))
         
-        img = Image.open(image)
-        logger.info(f"Image opened successfully. Format: {img.format}, Mode: {img.mode}, Size: {img.size}")
+        # PNGs and other formats carry no EXIF piexif can read; bail out
+        # before it tries to parse them
+        if not image_bytes.startswith(EXIF_MAGICS):
+            logger.debug("Not a JPEG or TIFF image, skipping EXIF parse")
+            return None
         
         try:
-            # Use piexif to load EXIF data
-            exif_dict = piexif.load(img.info.get('exif', b''))
-            logger.info("EXIF data extracted successfully")
-            
-            # Check if GPS data exists
-            gps_ifd = exif_dict.get('GPS', {})
+            # Only the four GPS tags are needed, so read them directly from
+            # the APP1 segment and fall back to a full piexif decode only
+            # when that fails
+            try:
+                gps_info = get_gps_fast(image_bytes)
+            except Exception as fast_error:
+                logger.debug("Fast GPS parse failed (%s), falling back to piexif", fast_error)
+                gps_info = get_gps_with_piexif(image_bytes)
             
-            if (piexif.GPSIFD.GPSLatitude in gps_ifd and 
-                piexif.GPSIFD.GPSLongitude in gps_ifd):
-                
-                gps_info = {
-                    'latitude': gps_ifd.get(piexif.GPSIFD.GPSLatitude),
-                    'latitude_ref': gps_ifd.get(piexif.GPSIFD.GPSLatitudeRef),
-                    'longitude': gps_ifd.get(piexif.GPSIFD.GPSLongitude),
-                    'longitude_ref': gps_ifd.get(piexif.GPSIFD.GPSLongitudeRef)
-                }
-                
-                logger.info(f"GPS Info extracted: {gps_info}")
+            if gps_info:
+                logger.debug("GPS Info extracted: %s", gps_info)
                 return gps_info
             else:
                 logger.warning("No GPS information found in EXIF data")
                 return None
         
         except Exception as exif_error:
-            logger.error(f"Error extracting EXIF data: {exif_error}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error extracting EXIF data: %s", exif_error)
             return None
     
     except Exception as e:
-        logger.error(f"Critical error in GPS extraction: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Critical error in GPS extraction: %s", e)
         return None
 
+# Reciprocals for the minutes and seconds terms of a DMS coordinate
+_INV60 = 1 / 60.0
+_INV3600 = 1 / 3600.0
+
+# References that make a coordinate negative, as bytes (EXIF) or str
+_NEG_REFS = frozenset((b'S', b'W', 'S', 'W'))
+
+def _rat(value):
+    # EXIF (numerator, denominator) tuple, or an already-numeric value such
+    # as a Fraction or float
+    if isinstance(value, tuple):
+        return value[0] / value[1]
+    return float(value)
+
 def dms_to_decimal(coords, ref):
     if not coords or not ref:
         return None
     
-    try:
-        # Unpack the coordinate tuple
-        degrees = coords[0][0] / coords[0][1]  # First tuple is degrees
-        minutes = coords[1][0] / coords[1][1]  # Second tuple is minutes
-        seconds = coords[2][0] / coords[2][1]  # Third tuple is seconds
-        
-        # Convert to decimal
-        decimal = degrees + (minutes / 60.0) + (seconds / 3600.0)
-        
-        # Apply sign based on reference
-        if ref in [b'S', b'W', 'S', 'W']:
-            decimal = -decimal
-        
-        return decimal
-    except Exception as conv_error:
-        logger.error(f"Coordinate conversion error: {conv_error}")
-        logger.error(f"Coordinates: {coords}, Reference: {ref}")
-        logger.error(traceback.format_exc())
-        return None
+    # Degrees, minutes and seconds are EXIF rationals.
+    # Malformed values raise here and are handled by convert_gps_to_decimal.
+    degrees, minutes, seconds = coords
+    decimal = _rat(degrees) + _rat(minutes) * _INV60 + _rat(seconds) * _INV3600
+    
+    return -decimal if ref in _NEG_REFS else decimal
 
 def convert_gps_to_decimal(gps_coords):
     if not gps_coords:
@@ -257,7 +682,7 @@ def convert_gps_to_decimal(gps_coords):
         return None, None
     
     try:
-        logger.info("Starting GPS coordinate conversion")
+        logger.debug("Starting GPS coordinate conversion")
         
         # Convert latitude and longitude
         latitude = dms_to_decimal(
@@ -269,28 +694,58 @@ def convert_gps_to_decimal(gps_coords):
             gps_coords.get('longitude_ref')
         )
         
-        logger.info(f"Converted Coordinates - Lat: {latitude}, Lon: {longitude}")
+        logger.debug("Converted Coordinates - Lat: %s, Lon: %s", latitude, longitude)
         
         return latitude, longitude
     
     except Exception as e:
-        logger.error(f"Error converting GPS coordinates: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error converting GPS coordinates: %s", e)
         
         return None, None
   
-def capture_image_location(captured_image):
+# EXIF GPS -> decimal coordinates, memoized on the image's content hash so
+# reruns with the same upload skip the EXIF parse. The bytes themselves are
+# excluded from the cache key (leading underscore) so they aren't hashed again.
+@st.cache_data(show_spinner=False)
+def extract_latlon(image_digest, _image_bytes):
+    gps_data = extract_gps_from_image(_image_bytes)
+    if not gps_data:
+        return None, None
+    
+    return convert_gps_to_decimal(gps_data)
+
+def refresh_location():
+    # Drop the cached fix and ask the browser again under a fresh component
+    # key, since reusing the old key would just return the old position
+    st.session_state.pop('gps_fix', None)
+    st.session_state['gps_request'] = st.session_state.get('gps_request', 0) + 1
+
+def capture_image_location(captured_image, digest):
+    # Only needed once the user picks the camera option
+    from streamlit_js_eval import get_geolocation
     
     try:
-        # Attempt to get geolocation
-        location = get_geolocation()
-        
-        if location and 'coords' in location:
-            # Extract coordinates from the nested structure
-            coords = location['coords']
-            latitude = coords.get('latitude')
-            longitude = coords.get('longitude')
-            accuracy = coords.get('accuracy')
+        # Reuse the fix taken for this same capture so reruns skip the
+        # browser round trip. A new photo (different digest) always asks the
+        # browser again, as does "Refresh location".
+        gps_fix = None
+        cached_fix = st.session_state.get('gps_fix')
+        if cached_fix and cached_fix[0] == digest:
+            gps_fix = cached_fix[1]
+        else:
+            # Attempt to get geolocation, under a component key unique to this
+            # capture so an earlier capture's position isn't returned
+            request = st.session_state.get('gps_request', 0)
+            location = get_geolocation(f"getLocation-{digest}-{request}")
+            
+            if location and 'coords' in location:
+                # Extract coordinates from the nested structure
+                coords = location['coords']
+                gps_fix = (coords.get('latitude'), coords.get('longitude'), coords.get('accuracy'))
+                st.session_state['gps_fix'] = (digest, gps_fix)
+        
+        if gps_fix:
+            latitude, longitude, accuracy = gps_fix
             
             # Display location details
             #st.success(f"Location Captured with Image:")
@@ -305,6 +760,8 @@ def capture_image_location(captured_image):
             with col3:
                 st.metric("Accuracy", f"{accuracy:.2f} meters")
             
+            st.button("Refresh location", on_click=refresh_location)
+            
             return latitude, longitude
         else:
             st.warning("Getting location from image 🛠️")
@@ -314,6 +771,53 @@ def capture_image_location(captured_image):
         st.error(f"Location capture error: {e}")
         return None, None
 
+# Shared path for uploaded and captured images
+def handle_image(image_file, location_method):
+    """
+    Start the ImgBB upload for an image and work out where it was taken
+    
+    :param image_file: Uploaded or captured Streamlit image
+    :param location_method: "Upload Image with GPS" or "Capture Image"
+    :return: (upload future, latitude, longitude)
+    """
+    # Read the image once and start the ImgBB upload in the background;
+    # the URL is only awaited when the form is submitted
+    image_bytes = image_file.getvalue()
+    digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+    image_upload = start_image_upload(image_bytes, image_file.name, digest)
+    latitude, longitude = None, None
+    
+    try:
+        if location_method == "Capture Image":
+            # Camera snapshots carry no EXIF, so ask the browser instead
+            latitude, longitude = capture_image_location(image_file, digest)
+        else:
+            latitude, longitude = extract_latlon(digest, image_bytes)
+            if latitude and longitude:
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.metric("Latitude", f"{latitude:.6f}")
+                with col2:
+                    st.metric("Longitude", f"{longitude:.6f}")
+            else:
+                st.warning("No GPS data found in the image")
+                # PNGs (e.g. screenshots) never reach the EXIF parser
+                if not image_bytes.startswith(EXIF_MAGICS):
+                    st.info("Only JPEG photos carry GPS data. Upload the original camera JPEG, or enter the location manually.")
+    
+    except Exception as e:
+        st.error(f"Error processing image: {e}")
+        # Show the full traceback
+        st.exception(e)
+    
+    return image_upload, latitude, longitude
+
+# Form options, built once at import instead of on every rerun
+ROAD_TYPES = ("Highway", "Urban Road", "Rural Road", "State Highway", "Other")
+DISTRESS_TYPES = ("Pothole", "Crack", "Rutting", "Deformation", "Other")
+SEVERITIES = ("Low", "Medium", "High", "Critical")
+LOCATION_METHODS = ("Manual Entry", "Upload Image with GPS", "Capture Image")
+UPLOAD_IMAGE_TYPES = ("jpg", "jpeg", "png")
 
 # Main Streamlit Application
 def main():
@@ -322,56 +826,12 @@ def main():
     
     st.title("Road Distress Point Data Collection")
     
-    # Create form sections
-    st.header("Road Distress Information")
-    
-    # Location Details
-    col1, col2 = st.columns(2)
-    with col1:
-        road_name = st.text_input("Road Name")
-        district = st.text_input("District")
-    
-    with col2:
-        road_type = st.selectbox("Road Type", [
-            "Highway", 
-            "Urban Road", 
-            "Rural Road", 
-            "State Highway", 
-            "Other"
-        ])
-        city = st.text_input("City")
-    
-    # Distress Details
-    col3, col4 = st.columns(2)
-    with col3:
-        distress_type = st.selectbox("Distress Type", [
-            "Pothole", 
-            "Crack", 
-            "Rutting", 
-            "Deformation", 
-            "Other"
-        ])
-        severity = st.selectbox("Severity", [
-            "Low", 
-            "Medium", 
-            "High", 
-            "Critical"
-        ])
-    
-    with col4:
-        distress_length = st.number_input("Distress Length (meters)", min_value=0.0, step=0.1)
-        distress_width = st.number_input("Distress Width (meters)", min_value=0.0, step=0.1)
-    
     # Geolocation Options
     st.header("Geolocation")
-    location_method = st.radio("Select Location Method", [
-        "Manual Entry", 
-        "Upload Image with GPS", 
-        "Capture Image"
-    ])
+    location_method = st.radio("Select Location Method", LOCATION_METHODS)
     
     latitude, longitude = None, None
-    uploaded_image_url = None
+    image_upload = None
     
     if location_method == "Manual Entry":
         col5, col6 = st.columns(2)
@@ -380,79 +840,73 @@ def main():
         with col6:
             longitude = st.number_input("Longitude", format="%.6f")
     
-    elif location_method == "Upload Image with GPS":
-        uploaded_image = st.file_uploader("Upload Image", type=['jpg', 'jpeg', 'png'])
-        if uploaded_image:
-            # Debug: Log uploaded image details
-            #st.write(f"Uploaded Image Name: {uploaded_image.name}")
-            #st.write(f"Uploaded Image Type: {uploaded_image.type}")
-            #st.write(f"Uploaded Image Size: {uploaded_image.size} bytes")
-            
-            # Upload image to ImgBB
-            uploaded_image_url = upload_to_imgbb(uploaded_image)
-            if uploaded_image_url:
-                successMsg = st.success("Image successfully uploaded")
-                time.sleep(3)
-                successMsg.empty()
-                #st.image(uploaded_image_url, caption="Uploaded Image")
-            
-                # Extract GPS from uploaded image with logging
-                try:
-                    gps_data = extract_gps_from_image(uploaded_image)
-
-                    if gps_data:
-                        latitude, longitude = convert_gps_to_decimal(gps_data)
-                        if latitude and longitude:
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.metric("Latitude", f"{latitude:.6f}")
-                            with col2:
-                                st.metric("Longitude", f"{longitude:.6f}")
-                        else:
-                            st.warning("No GPS data found in the image")
-            
-                except Exception as e:
-                    st.error(f"Error processing image: {e}")
-                    # Log the full traceback
-                    st.error(traceback.format_exc())
-    
-    elif location_method == "Capture Image":
-        latitude, longitude = None, None
-        captured_image = st.camera_input("Capture Image")
-                
-        if captured_image:
-            # Debug: Log captured image details
-            #st.write(f"Captured Image Name: {captured_image.name}")
-            #st.write(f"Captured Image Type: {captured_image.type}")
-            #st.write(f"Captured Image Size: {captured_image.size} bytes")
-            #st.success("Image captured successfully")
-            
-            # Extract GPS from captured image
-            try:
-                latitude, longitude = capture_image_location(captured_image)
- 
-            except Exception as e:
-                st.error(f"Error processing captured image: {e}")
-                # Log the full traceback
-                st.error(traceback.format_exc())
-                
-            # Upload image to ImgBB
-            uploaded_image_url = upload_to_imgbb(captured_image)
-            if uploaded_image_url:
-                successMsg = st.success("Image successfully captured & uploaded")
-                time.sleep(3)
-                successMsg.empty()
-    
-    # Additional Notes
-    additional_notes = st.text_area("Additional Notes")
+    else:
+        if location_method == "Upload Image with GPS":
+            image_file = st.file_uploader("Upload Image", type=UPLOAD_IMAGE_TYPES)
+        else:
+            image_file = st.camera_input("Capture Image")
+        
+        if image_file:
+            image_upload, latitude, longitude = handle_image(image_file, location_method)
+    
+    # The remaining fields are batched in a form so typing into them doesn't
+    # rerun the script; only the submit button does. The location inputs
+    # stay outside because they have to react as soon as they change.
+    with st.form("distress_form", clear_on_submit=False):
+        st.header("Road Distress Information")
+        
+        # Location Details
+        col1, col2 = st.columns(2)
+        with col1:
+            road_name = st.text_input("Road Name")
+            district = st.text_input("District")
+        
+        with col2:
+            road_type = st.selectbox("Road Type", ROAD_TYPES)
+            city = st.text_input("City")
+        
+        # Distress Details
+        col3, col4 = st.columns(2)
+        with col3:
+            distress_type = st.selectbox("Distress Type", DISTRESS_TYPES)
+            severity = st.selectbox("Severity", SEVERITIES)
+        
+        with col4:
+            distress_length = st.number_input("Distress Length (meters)", min_value=0.0, step=0.1)
+            distress_width = st.number_input("Distress Width (meters)", min_value=0.0, step=0.1)
+        
+        # Additional Notes
+        additional_notes = st.text_area("Additional Notes")
+        
+        submitted = st.form_submit_button("Submit Road Distress Data")
     
     # Submit Button
-    if st.button("Submit Road Distress Data"):
+    if submitted:
         # Validate required fields
-        if not all([road_name, district, road_type, distress_type, severity]):
+        if not road_name or not district:
             st.error("Please fill in all required fields")
             return
         
+        # Authenticate first: on a cold cache this (and any Pantry fetch)
+        # overlaps with the image upload still running in the background
+        client = authenticate_google_sheets()
+        if client is None:
+            # Don't keep a failed login cached until the TTL expires
+            reset_google_sheets()
+            return
+        
+        # Wait for the background image upload, if one was started
+        uploaded_image_url = None
+        if image_upload is not None:
+            # Don't hold the script thread indefinitely on a slow upload; a
+            # timed-out upload is treated like a failed one
+            try:
+                uploaded_image_url = image_upload.result(timeout=IMGBB_RESULT_TIMEOUT)
+            except FutureTimeoutError:
+                logger.error("ImgBB upload did not finish within %ss", IMGBB_RESULT_TIMEOUT)
+            if not uploaded_image_url:
+                st.warning("Image upload failed, submitting without an image URL")
+        
         # Prepare data for Google Sheets
         data_to_submit = {
             "Road Name": road_name,
@@ -470,18 +924,34 @@ def main():
         }
         
         # Log the data being submitted
-        logger.info(f"Submitting data: {data_to_submit}")
+        logger.debug("Submitting data: %s", data_to_submit)
         
-        # Authenticate and submit to Google Sheets
-        client = authenticate_google_sheets()
-        if client:
-            success = submit_to_google_sheets(client, data_to_submit)
-            if success:
-                successMsg = st.success("Data successfully submitted!")
-                time.sleep(3)
-                successMsg.empty()
+        # Submit to Google Sheets
+        success = submit_to_google_sheets(client, data_to_submit)
+        if success:
+            pending_count = len(st.session_state.get('pending_rows', []))
+            # Toasts dismiss themselves in the browser, so the rerun isn't held up
+            if pending_count:
+                st.toast(
+                    f"{pending_count} row(s) queued but not yet sent to Google Sheets; "
+                    "they will be lost if this tab is closed before they are flushed",
+                    icon="⚠️"
+                )
             else:
-                st.error("Failed to submit data to Google Sheets")
+                st.toast("Data successfully submitted!", icon="✅")
+        else:
+            st.error("Failed to submit data to Google Sheets")
+    
+    # Flush Button
+    pending_count = len(st.session_state.get('pending_rows', []))
+    if pending_count and st.button(f"Flush {pending_count} Pending Row(s)"):
+        client = authenticate_google_sheets()
+        if client is None:
+            reset_google_sheets()
+        elif flush_pending_rows(client):
+            st.toast("Data successfully submitted!", icon="✅")
+        else:
+            st.error("Failed to submit data to Google Sheets")
 
 # Run the Streamlit app
 if __name__ == "__main__":